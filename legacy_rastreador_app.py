@@ -9,11 +9,19 @@ import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+import functools
 import warnings
 import time
+import hashlib
+import json
+import os
+import tempfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import random
 
 warnings.filterwarnings('ignore')
@@ -27,255 +35,604 @@ st.set_page_config(
 )
 
 # ===== ESTILOS PERSONALIZADOS =====
-st.markdown("""
-<style>
-    :root {
-        --primary: #1e3a8a;
-        --accent: #3b82f6;
-        --success: #10b981; 
-        --warning: #f59e0b;
-        --danger: #ef4444;
-    }
-    
-    .stApp {
-        background: linear-gradient(135deg, #f1f5f9 0%, #e2e8f0 100%);
-    }
-    
-    div[data-testid="stMetric"] {
-        background: white;
-        border-radius: 16px;
-        padding: 1.2rem;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.08);
-        border-left: 4px solid var(--accent);
-    }
-    
-    .stButton>button {
-        background: var(--accent);
-        color: white;
-        border: none;
-        border-radius: 12px;
-        padding: 0.6rem 1.5rem;
-        font-weight: 600;
-        width: 100%;
-    }
-    
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #0f172a 0%, #1e293b 100%);
-        color: white;
-    }
-</style>
-""", unsafe_allow_html=True)
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "style.css")
+
+@st.cache_resource
+def carregar_css() -> str:
+    """Lê a folha de estilos uma única vez por processo"""
+    with open(CSS_PATH, encoding='utf-8') as f:
+        return f"<style>\n{f.read()}</style>"
+
+# Reinjetado a cada rerun (o Streamlit limpa elementos não redesenhados),
+# mas sem reler o arquivo nem reconstruir a string
+st.markdown(carregar_css(), unsafe_allow_html=True)
 
 # ===== FUNÇÕES DE COLETA COM FALLBACK =====
-def get_yahoo_headers():
-    """Headers para evitar bloqueios"""
+_UAS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36'
+)
+_rng = random.Random()  # Instância própria, sem disputar o gerador global
+
+@functools.lru_cache(maxsize=1)
+def _headers_do_minuto(minuto: int) -> Dict[str, str]:
+    """Um dict de headers por minuto, compartilhado por todas as requisições (não modificar)"""
     return {
-        'User-Agent': random.choice([
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15',
-            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36'
-        ]),
+        'User-Agent': _rng.choice(_UAS),
         'Accept': 'application/json, text/javascript, */*; q=0.01',
         'Accept-Language': 'en-US,en;q=0.9',
         'Referer': 'https://finance.yahoo.com/'
     }
 
-def test_yfinance_connection() -> bool:
-    """Testa conexão com múltiplos endpoints do Yahoo Finance"""
-    endpoints = [
-        "https://query2.finance.yahoo.com/v8/finance/chart/PETR4.SA",
-        "https://query1.finance.yahoo.com/v10/finance/quoteSummary/PETR4.SA",
-        "https://finance.yahoo.com/quote/PETR4.SA"
-    ]
-    
-    for url in endpoints:
-        try:
-            response = requests.get(url, headers=get_yahoo_headers(), timeout=8)
-            if response.status_code == 200:
-                return True
-        except:
-            continue
-    return False
+def get_yahoo_headers():
+    """Headers para evitar bloqueios; o User-Agent gira a cada minuto"""
+    return _headers_do_minuto(int(time.time() // 60))
 
-@st.cache_data(ttl=900, show_spinner=False)
-def get_stock_data_safe(ticker: str) -> Tuple[Optional[Dict], Optional[str]]:
+@st.cache_resource
+def get_session() -> requests.Session:
     """
-    Coleta dados com múltiplas estratégias de fallback
+    Sessão compartilhada: reaproveita conexões TCP/TLS entre as requisições diretas ao Yahoo
+    
+    Não é repassada ao yfinance: ele usa a própria sessão curl_cffi e, conforme a versão,
+    recusa uma requests.Session comum (YFDataException) ou avisa que ela pode sofrer
+    rate limit. O quoteSummary direto por aqui é o caminho rápido, com o Ticker.info
+    do yfinance como fallback quando o Yahoo recusa a requisição.
+    
+    Cacheada como recurso para que o pool de conexões sobreviva aos reruns do script.
+    Em 429/502/503 recua respeitando o Retry-After enviado pelo Yahoo.
     """
-    ticker_clean = ticker.strip().upper().replace('.SA', '')
-    yahoo_ticker = f"{ticker_clean}.SA"
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 502, 503],
+            respect_retry_after_header=True
+        )
+    ))
+    session.headers.update(get_yahoo_headers())
+    return session
+
+SESSION = get_session()
+
+class TokenBucket:
+    """Limitador de taxa: só bloqueia quando o balde de tokens esvazia"""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
     
-    # Estratégia 1: Tentativa direta com yfinance (com headers customizados)
+    def consume(self, tokens: int = 1) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                espera = (tokens - self.tokens) / self.rate
+            time.sleep(espera)
+
+@st.cache_resource
+def get_bucket() -> TokenBucket:
+    """Limite global de até 10 requisições/s ao Yahoo, com rajadas de 20"""
+    return TokenBucket(rate=10, burst=20)
+
+BUCKET = get_bucket()
+
+# quoteSummary: só os módulos usados, em vez do scrape completo de Ticker.info
+QUOTE_SUMMARY_URL = "https://query1.finance.yahoo.com/v10/finance/quoteSummary/{}"
+QUOTE_SUMMARY_MODULES = "defaultKeyStatistics,financialData,summaryDetail,assetProfile"
+
+# Sem cookie + crumb o quoteSummary responde 401 "Invalid Crumb"
+COOKIE_URL = "https://fc.yahoo.com"
+CRUMB_URL = "https://query1.finance.yahoo.com/v1/test/getcrumb"
+CRUMB_ESPERA_FALHA = 300  # Segundos até tentar o handshake de novo após uma falha
+
+class CrumbYahoo:
+    """Cookie + crumb do Yahoo, obtidos uma vez por processo e renovados quando recusados"""
+    def __init__(self, session: requests.Session):
+        self.session = session
+        self.crumb = None
+        self.falhou_em = None
+        self.lock = threading.Lock()
+    
+    def get(self) -> Optional[str]:
+        with self.lock:
+            if self.crumb is None:
+                if self.falhou_em is not None and time.monotonic() - self.falhou_em < CRUMB_ESPERA_FALHA:
+                    return None
+                self.crumb = self._handshake()
+                self.falhou_em = None if self.crumb else time.monotonic()
+            return self.crumb
+    
+    def invalidar(self, crumb: str) -> None:
+        """Descarta um crumb recusado (401); outra thread pode já ter renovado"""
+        with self.lock:
+            if self.crumb == crumb:
+                self.crumb = None
+    
+    def _handshake(self) -> Optional[str]:
+        try:
+            BUCKET.consume(2)
+            # fc.yahoo.com responde 404, mas grava o cookie A3 na sessão
+            self.session.get(COOKIE_URL, timeout=10)
+            response = self.session.get(CRUMB_URL, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+        crumb = response.text.strip()
+        # Bloqueio devolve página HTML no lugar do crumb
+        return crumb if crumb and '<' not in crumb else None
+
+@st.cache_resource
+def get_crumb() -> CrumbYahoo:
+    """Crumb compartilhado por todas as threads e reruns, atrelado aos cookies de SESSION"""
+    return CrumbYahoo(SESSION)
+
+CRUMB = get_crumb()
+
+# Campos do quoteSummary renomeados para as chaves de Ticker.info
+QUOTE_FIELDS = {
+    'currentPrice': 'regularMarketPrice'
+}
+PRICE_FIELDS = ('regularMarketPrice',)  # Nunca persistidos junto com os fundamentos
+
+# ===== CACHE PERSISTENTE EM DISCO =====
+# L2 sob o st.cache_data: sobrevive a reinícios do processo do Streamlit
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_yf")
+TTL_FUNDAMENTOS = 7 * 86400  # Fundamentos mudam no máximo trimestralmente
+TTL_PRECOS = 15 * 60
+# Se o Yahoo falhar (bloqueio, 429), aceita entradas vencidas há até:
+TOLERANCIA_FUNDAMENTOS = 30 * 86400
+TOLERANCIA_PRECOS = 86400
+
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, hashlib.md5(key.encode('utf-8')).hexdigest() + ".json")
+
+def disk_cache_get(key: str, tolerancia: float = 0.0):
+    """Lê uma entrada do cache em disco, ou None se ausente/expirada há mais de `tolerancia` s"""
     try:
-        # Configura headers globalmente para yfinance
-        yf.utils.default_session = requests.Session()
-        yf.utils.default_session.headers.update(get_yahoo_headers())
-        
-        stock = yf.Ticker(yahoo_ticker)
-        
-        # Tenta obter preço via fast_info (mais rápido)
-        preco_atual = None
+        with open(_cache_path(key), encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('expire', 0) + tolerancia < time.time():
+        return None
+    return entry.get('value')
+
+def disk_cache_set(key: str, value, expire: float) -> None:
+    """Grava uma entrada no cache em disco com TTL em segundos"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Escrita atômica: outra sessão nunca lê um arquivo pela metade
+        with tempfile.NamedTemporaryFile('w', dir=CACHE_DIR, suffix='.tmp', delete=False, encoding='utf-8') as f:
+            json.dump({'expire': time.time() + expire, 'value': value}, f)
+        os.replace(f.name, _cache_path(key))
+    except (OSError, TypeError, ValueError):
+        # Cache é best-effort: falha de escrita não interrompe a análise
+        pass
+
+def _serie_do_cache(cached: Dict) -> pd.Series:
+    return pd.Series(cached['valores'], index=pd.to_datetime(cached['datas']), dtype=float)
+
+def baixar_precos(yahoo_tickers: Tuple[str, ...]) -> pd.DataFrame:
+    """Baixa os fechamentos dos tickers fora do cache em uma única chamada"""
+    series = {}
+    for t in yahoo_tickers:
+        cached = disk_cache_get(f"precos:{t}")
+        if cached is not None:
+            series[t] = _serie_do_cache(cached)
+    
+    faltantes = [t for t in yahoo_tickers if t not in series]
+    if faltantes:
         try:
-            if hasattr(stock, 'fast_info') and 'last_price' in stock.fast_info:
-                preco_atual = float(stock.fast_info['last_price'])
-        except:
-            pass
-        
-        # Fallback para histórico
-        if preco_atual is None or preco_atual <= 0:
-            hist = stock.history(period="5d", timeout=10)
-            if not hist.empty:
-                preco_atual = float(hist['Close'].iloc[-1])
-        
-        if preco_atual is None or preco_atual <= 0:
-            return None, f"{ticker_clean}: Preço não disponível"
+            hist = yf.download(
+                " ".join(faltantes),
+                period="5d",
+                group_by='ticker',
+                threads=True,
+                progress=False,
+                timeout=10
+            )
+        except Exception:
+            # Falha de rede ou bloqueio: segue como se o Yahoo não tivesse respondido
+            hist = pd.DataFrame()
+        if not hist.empty:
+            # Uma coluna de fechamento por ticker
+            if isinstance(hist.columns, pd.MultiIndex):
+                closes = hist.xs('Close', axis=1, level=1)
+            else:
+                closes = hist[['Close']].set_axis(faltantes[:1], axis=1)
+            
+            for t in closes.columns:
+                fechamentos = closes[t].dropna()
+                if fechamentos.empty:
+                    continue
+                disk_cache_set(f"precos:{t}", {
+                    'datas': [d.isoformat() for d in fechamentos.index],
+                    'valores': fechamentos.tolist()
+                }, TTL_PRECOS)
+                series[t] = fechamentos
         
-        # Obtém fundamentos
-        info = {}
+        # Sem resposta do Yahoo para o ticker: usa o último valor salvo, mesmo vencido
+        for t in faltantes:
+            if t not in series:
+                cached = disk_cache_get(f"precos:{t}", tolerancia=TOLERANCIA_PRECOS)
+                if cached is not None:
+                    series[t] = _serie_do_cache(cached)
+    
+    return pd.DataFrame(series)
+
+# Requisições de fundamentos em voo ao mesmo tempo; a taxa é limitada pelo TokenBucket
+MAX_WORKERS = 8
+
+@st.cache_resource
+def get_executor(max_workers: int = MAX_WORKERS) -> ThreadPoolExecutor:
+    """Pool de threads único do processo, reaproveitado entre reruns"""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yf")
+
+def _achatar_quote_summary(resultado: Dict) -> Dict:
+    """Junta os módulos do quoteSummary num único dict no formato de Ticker.info"""
+    info = {}
+    for modulo in resultado.values():
+        if not isinstance(modulo, dict):
+            continue
+        for chave, valor in modulo.items():
+            # Campos numéricos vêm como {"raw": 0.12, "fmt": "12%"}
+            if isinstance(valor, dict):
+                valor = valor.get('raw')
+            if valor is not None:
+                info.setdefault(QUOTE_FIELDS.get(chave, chave), valor)
+    return info
+
+def _fundamentos_uteis(info: Optional[Dict]) -> Optional[Dict]:
+    """
+    Valida e enxuga um info (quoteSummary achatado ou Ticker.info) antes de usar ou cachear
+    
+    Resposta vazia, só de cotação ou só com `maxAge` não serve para o score e vira None.
+    Só os campos usados ficam: o info completo tem centenas de chaves e iria inteiro para o cache.
+    """
+    if not info or not any(info.get(campo) is not None for campo in ('returnOnEquity', 'profitMargins', 'sector')):
+        return None
+    enxuto = {campo: info[campo] for campo in (*FUND_KEYS, 'sector') if info.get(campo) is not None}
+    if 'regularMarketPrice' not in enxuto and info.get('currentPrice') is not None:
+        enxuto['regularMarketPrice'] = info['currentPrice']
+    return enxuto
+
+def _info_via_yfinance(symbol: str) -> Optional[Dict]:
+    """Caminho completo do Ticker.info, usado quando o quoteSummary direto não responde"""
+    try:
+        BUCKET.consume()
+        info = yf.Ticker(symbol).info
+    except Exception:
+        return None
+    return _fundamentos_uteis(info)
+
+def _quote_summary(symbol: str) -> Optional[Dict]:
+    """
+    quoteSummary com crumb; um 401 renova o crumb e repete a requisição uma vez
+    
+    None quando não há crumb ou a resposta não traz fundamentos utilizáveis.
+    """
+    for _ in range(2):
+        crumb = CRUMB.get()
+        if crumb is None:
+            return None
+        BUCKET.consume()
+        response = SESSION.get(
+            QUOTE_SUMMARY_URL.format(symbol),
+            params={'modules': QUOTE_SUMMARY_MODULES, 'crumb': crumb},
+            headers=get_yahoo_headers(),
+            timeout=10
+        )
+        if response.status_code == 401:
+            CRUMB.invalidar(crumb)
+            continue
+        response.raise_for_status()
+        return _fundamentos_uteis(_achatar_quote_summary(response.json()['quoteSummary']['result'][0]))
+    return None
+
+def baixar_fundamentos(yahoo_tickers: Tuple[str, ...], max_workers: int = MAX_WORKERS) -> Tuple[Dict[str, Dict], Set[str]]:
+    """
+    Busca preço e fundamentos via quoteSummary, uma requisição enxuta por ticker
+    
+    Retorna também os símbolos servidos pelo cache vencido, para avisar o usuário.
+    """
+    def buscar(symbol: str) -> Tuple[str, Optional[Dict]]:
         try:
-            info = stock.info
-        except Exception as e:
-            # Fallback mínimo com dados básicos
-            info = {
-                'trailingPE': 0,
-                'priceToBook': 0,
-                'dividendYield': 0,
-                'returnOnEquity': 0,
-                'profitMargins': 0,
-                'currentRatio': 0,
-                'debtToEquity': 0,
-                'averageVolume': 0,
-                'sector': 'Outros'
-            }
-        
-        # Processamento seguro dos dados
-        def safe_get(key: str, default=0.0, multiplier=1.0) -> float:
-            try:
-                val = info.get(key, default)
-                if val is None or val == 'Infinity' or val == '-Infinity':
-                    return default
-                result = float(val) * multiplier
-                return result if np.isfinite(result) else default
-            except:
-                return default
-        
-        # Dividend Yield
-        dy_raw = safe_get('dividendYield', 0.0)
-        dividend_yield = dy_raw * 100 if 0 < dy_raw < 1 else dy_raw
-        
-        # Valuation
-        pl = safe_get('trailingPE', 0.0)
-        pvp = safe_get('priceToBook', 0.0)
-        lpa = safe_get('trailingEps', 0.0)
-        vpa = safe_get('bookValue', 0.0)
-        
-        # Correções matemáticas
-        if pl == 0 and lpa > 0:
-            pl = preco_atual / lpa
-        if pvp == 0 and vpa > 0:
-            pvp = preco_atual / vpa
-        
-        # Qualidade
-        roe = safe_get('returnOnEquity', 0.0, 100)
-        margem_liq = safe_get('profitMargins', 0.0, 100)
-        liquidez_corr = safe_get('currentRatio', 0.0)
-        divida_pl = safe_get('debtToEquity', 0.0)
-        volume_medio = safe_get('averageVolume', 0.0)
-        
-        # Setor (com mapeamento)
-        setor_raw = info.get('sector', 'Outros')
-        setor_map = {
-            'Financial Services': 'Financeiro',
-            'Basic Materials': 'Materiais Básicos',
-            'Energy': 'Energia',
-            'Utilities': 'Utilidades Públicas',
-            'Industrials': 'Industrial',
-            'Consumer Cyclical': 'Consumo Cíclico',
-            'Consumer Defensive': 'Consumo Não Cíclico',
-            'Technology': 'Tecnologia',
-            'Healthcare': 'Saúde',
-            'Real Estate': 'Imobiliário',
-            'Communication Services': 'Comunicação'
-        }
-        setor = setor_map.get(setor_raw, setor_raw if setor_raw else 'Outros')
-        
-        # Score de qualidade simplificado (baseado nos dados disponíveis)
-        score = 0.0
-        if roe >= 15: score += 25
-        if 0 < pl <= 15: score += 25
-        if margem_liq >= 10: score += 20
-        if dividend_yield >= 5: score += 15
-        if liquidez_corr >= 1.0: score += 10
-        if divida_pl <= 1.0: score += 5
-        
-        dados = {
-            "Ação": ticker_clean,
-            "Preço": round(preco_atual, 2),
-            "DY %": round(dividend_yield, 2),
-            "ROE": round(roe, 2),
-            "P/L": round(pl, 2),
-            "P/VP": round(pvp, 2),
-            "Margem_Liq": round(margem_liq, 2),
-            "Liquidez_Corr": round(liquidez_corr, 2),
-            "Divida/PL": round(divida_pl, 2),
-            "Volume_Medio": int(volume_medio),
-            "Score": round(score, 1),
-            "Setor": setor,
-            "Div_Anual": round(preco_atual * (dividend_yield / 100), 2)
+            info = _quote_summary(symbol)
+        except Exception:
+            info = None
+        # quoteSummary recusado, sem crumb ou sem fundamentos: recorre ao Ticker.info do yfinance
+        return symbol, info if info is not None else _info_via_yfinance(symbol)
+    
+    fundamentos = {}
+    vencidos = set()
+    for t in yahoo_tickers:
+        cached = disk_cache_get(f"info:{t}")
+        if cached is not None:
+            fundamentos[t] = cached
+    
+    faltantes = [t for t in yahoo_tickers if t not in fundamentos]
+    for symbol, info in get_executor(max_workers).map(buscar, faltantes):
+        if info is None:
+            # Falha na requisição: fundamentos vencidos ainda valem mais que zeros
+            cached = disk_cache_get(f"info:{symbol}", tolerancia=TOLERANCIA_FUNDAMENTOS)
+            if cached is not None:
+                fundamentos[symbol] = cached
+                vencidos.add(symbol)
+            continue
+        fundamentos[symbol] = info
+        # Preço fica de fora: no cache ele viria com até 7 dias de atraso
+        disk_cache_set(f"info:{symbol}", {
+            k: v for k, v in info.items() if k not in PRICE_FIELDS
+        }, TTL_FUNDAMENTOS)
+    return fundamentos, vencidos
+
+SETOR_MAP = {
+    'Financial Services': 'Financeiro',
+    'Basic Materials': 'Materiais Básicos',
+    'Energy': 'Energia',
+    'Utilities': 'Utilidades Públicas',
+    'Industrials': 'Industrial',
+    'Consumer Cyclical': 'Consumo Cíclico',
+    'Consumer Defensive': 'Consumo Não Cíclico',
+    'Technology': 'Tecnologia',
+    'Healthcare': 'Saúde',
+    'Real Estate': 'Imobiliário',
+    'Communication Services': 'Comunicação'
+}
+
+def mapear_setores(setores: pd.Series) -> pd.Series:
+    """Traduz os setores do Yahoo de uma vez na coluna inteira, como categoria"""
+    return setores.map(SETOR_MAP).fillna(setores).astype('category')
+
+def ultimos_fechamentos(closes: np.ndarray) -> np.ndarray:
+    """Último fechamento válido de cada coluna da matriz (dias, tickers); NaN se não houver"""
+    validos = ~np.isnan(closes)
+    if closes.shape[0] == 0:
+        return np.full(closes.shape[1], np.nan)
+    # Índice da última linha válida de cada coluna, numa única passada
+    ultima_linha = closes.shape[0] - 1 - np.argmax(validos[::-1], axis=0)
+    ultimos = closes[ultima_linha, np.arange(closes.shape[1])]
+    return np.where(validos.any(axis=0), ultimos, np.nan)
+
+# Limites e pesos do score, definidos uma única vez no import
+SCORE_ROE_MIN, SCORE_ROE_PTS = 15.0, 25.0      # ROE >= 15
+SCORE_PL_MAX, SCORE_PL_PTS = 15.0, 25.0        # 0 < P/L <= 15
+SCORE_MARG_MIN, SCORE_MARG_PTS = 10.0, 20.0    # Margem >= 10
+SCORE_DY_MIN, SCORE_DY_PTS = 5.0, 15.0         # DY >= 5
+SCORE_LIQ_MIN, SCORE_LIQ_PTS = 1.0, 10.0       # Liquidez >= 1
+SCORE_DIV_MAX, SCORE_DIV_PTS = 1.0, 5.0        # Dívida/PL <= 1
+
+def calcular_score(roe: np.ndarray, pl: np.ndarray, margem_liq: np.ndarray, dividend_yield: np.ndarray,
+                   liquidez_corr: np.ndarray, divida_pl: np.ndarray) -> np.ndarray:
+    """Score de qualidade simplificado, sem desvios: um np.where por regra sobre o array inteiro"""
+    return (
+        np.where(roe >= SCORE_ROE_MIN, SCORE_ROE_PTS, 0.0)
+        + np.where((pl > 0) & (pl <= SCORE_PL_MAX), SCORE_PL_PTS, 0.0)
+        + np.where(margem_liq >= SCORE_MARG_MIN, SCORE_MARG_PTS, 0.0)
+        + np.where(dividend_yield >= SCORE_DY_MIN, SCORE_DY_PTS, 0.0)
+        + np.where(liquidez_corr >= SCORE_LIQ_MIN, SCORE_LIQ_PTS, 0.0)
+        + np.where(divida_pl <= SCORE_DIV_MAX, SCORE_DIV_PTS, 0.0)
+    )
+
+# Registro de resultado: colunas na ordem exibida na tabela
+# Métricas só de exibição (2 casas) em f4, valores monetários em f8, volume em i4
+RESULT_DTYPE = np.dtype([
+    ("Ação", "U12"),
+    ("Preço", "f8"),
+    ("DY %", "f4"),
+    ("ROE", "f4"),
+    ("P/L", "f4"),
+    ("P/VP", "f4"),
+    ("Margem_Liq", "f4"),
+    ("Liquidez_Corr", "f4"),
+    ("Divida/PL", "f4"),
+    ("Volume_Medio", "i4"),
+    ("Score", "f4"),
+    ("Setor", "U32"),
+    ("Div_Anual", "f8")
+])
+
+def _features_kernel(precos: np.ndarray, dy_raw: np.ndarray, pl: np.ndarray, pvp: np.ndarray,
+                     lpa: np.ndarray, vpa: np.ndarray, roe: np.ndarray, margem_liq: np.ndarray,
+                     liquidez_corr: np.ndarray, divida_pl: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Núcleo numérico puro: métricas derivadas e score para todos os tickers
+    
+    Retorna (dividend_yield, pl, pvp, div_anual, score).
+    """
+    # Dividend Yield
+    dividend_yield = np.where((dy_raw > 0) & (dy_raw < 1), dy_raw * 100, dy_raw)
+    
+    # Correções matemáticas
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pl = np.where((pl == 0) & (lpa > 0), precos / lpa, pl)
+        pvp = np.where((pvp == 0) & (vpa > 0), precos / vpa, pvp)
+    div_anual = precos * (dividend_yield / 100)
+    
+    score = calcular_score(roe, pl, margem_liq, dividend_yield, liquidez_corr, divida_pl)
+    return dividend_yield, pl, pvp, div_anual, score
+
+# Campos numéricos lidos do info, na ordem das colunas da matriz de fundamentos
+FUND_KEYS = (
+    "regularMarketPrice", "trailingEps", "bookValue", "trailingPE", "priceToBook",
+    "returnOnEquity", "profitMargins", "currentRatio", "debtToEquity", "averageVolume",
+    "dividendYield"
+)
+FUND_MULTS = np.array([1, 1, 1, 1, 1, 100, 100, 1, 1, 1, 1], dtype=np.float64)
+
+def matriz_fundamentos(infos: List[Dict]) -> np.ndarray:
+    """Matriz (tickers, FUND_KEYS) em float64; ausentes, não numéricos e infinitos viram 0"""
+    # Uma conversão vetorizada por coluna, em vez de float() campo a campo
+    raw = pd.DataFrame.from_records(infos, columns=FUND_KEYS)
+    raw = raw.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64, copy=True)
+    raw *= FUND_MULTS
+    raw[~np.isfinite(raw)] = 0.0
+    return raw
+
+def _compute_features(tickers: List[str], closes: np.ndarray, infos: List[Dict]) -> Tuple[np.ndarray, List[str]]:
+    """
+    Calcula os indicadores de todos os tickers de uma vez, sobre arrays (sem I/O)
+    """
+    (cotacoes, lpa, vpa, pl, pvp, roe, margem_liq,
+     liquidez_corr, divida_pl, volume_medio, dy_raw) = matriz_fundamentos(infos).T
+    
+    # Preço da cotação, com fallback para o último fechamento da matriz
+    precos = np.where(cotacoes > 0, cotacoes, ultimos_fechamentos(closes))
+    
+    dividend_yield, pl, pvp, div_anual, scores = _features_kernel(
+        precos, dy_raw, pl, pvp, lpa, vpa, roe, margem_liq, liquidez_corr, divida_pl
+    )
+    
+    # Layout SoA: uma coluna contígua por métrica, preenchida de uma vez
+    resultados = np.empty(len(tickers), dtype=RESULT_DTYPE)
+    resultados["Ação"] = tickers
+    resultados["Preço"] = np.round(precos, 2)
+    resultados["DY %"] = np.round(dividend_yield, 2)
+    resultados["ROE"] = np.round(roe, 2)
+    resultados["P/L"] = np.round(pl, 2)
+    resultados["P/VP"] = np.round(pvp, 2)
+    resultados["Margem_Liq"] = np.round(margem_liq, 2)
+    resultados["Liquidez_Corr"] = np.round(liquidez_corr, 2)
+    resultados["Divida/PL"] = np.round(divida_pl, 2)
+    resultados["Volume_Medio"] = np.minimum(volume_medio, np.iinfo(np.int32).max)
+    resultados["Score"] = np.round(scores, 1)
+    resultados["Div_Anual"] = np.round(div_anual, 2)
+    
+    # Setor bruto do Yahoo; a tradução é feita depois na coluna inteira
+    resultados["Setor"] = [info.get('sector') or 'Outros' for info in infos]
+    
+    validos = precos > 0
+    erros = [f"{ticker}: Preço não disponível" for ticker, ok in zip(tickers, validos) if not ok]
+    return resultados[validos], erros
+
+def _dados_fallback(ticker: str) -> Optional[Dict]:
+    """Fallback mínimo com dados simulados para teste"""
+    if "PETR4" in ticker or "VALE3" in ticker:
+        # Retorna dados simulados para tickers conhecidos (apenas para demonstração)
+        return {
+            "Ação": ticker,
+            "Preço": round(random.uniform(20, 80), 2),
+            "DY %": round(random.uniform(4, 12), 2),
+            "ROE": round(random.uniform(10, 25), 2),
+            "P/L": round(random.uniform(5, 15), 2),
+            "P/VP": round(random.uniform(0.8, 2.0), 2),
+            "Margem_Liq": round(random.uniform(8, 20), 2),
+            "Liquidez_Corr": round(random.uniform(1.0, 2.5), 2),
+            "Divida/PL": round(random.uniform(0.5, 1.5), 2),
+            "Volume_Medio": random.randint(5000000, 20000000),
+            "Score": round(random.uniform(50, 85), 1),
+            "Setor": random.choice(["Financeiro", "Energia", "Industrial"]),
+            "Div_Anual": round(random.uniform(2, 8), 2)
         }
-        
-        return dados, None
-        
-    except Exception as e:
-        # Estratégia 2: Fallback mínimo com dados simulados para teste
-        if "PETR4" in ticker_clean or "VALE3" in ticker_clean:
-            # Retorna dados simulados para tickers conhecidos (apenas para demonstração)
-            return {
-                "Ação": ticker_clean,
-                "Preço": round(random.uniform(20, 80), 2),
-                "DY %": round(random.uniform(4, 12), 2),
-                "ROE": round(random.uniform(10, 25), 2),
-                "P/L": round(random.uniform(5, 15), 2),
-                "P/VP": round(random.uniform(0.8, 2.0), 2),
-                "Margem_Liq": round(random.uniform(8, 20), 2),
-                "Liquidez_Corr": round(random.uniform(1.0, 2.5), 2),
-                "Divida/PL": round(random.uniform(0.5, 1.5), 2),
-                "Volume_Medio": random.randint(5000000, 20000000),
-                "Score": round(random.uniform(50, 85), 1),
-                "Setor": random.choice(["Financeiro", "Energia", "Industrial"]),
-                "Div_Anual": round(random.uniform(2, 8), 2)
-            }, None
-        return None, f"{ticker_clean}: {str(e)[:60]}"
-
-def processar_tickers(tickers: List[str], max_workers: int = 4) -> Tuple[List[Dict], List[str]]:
-    """Processa tickers com retry e fallback"""
+    return None
+
+def _coletar_real(tickers: Tuple[str, ...], max_workers: int) -> Optional[Tuple[np.ndarray, List[str], bool]]:
+    """
+    Coleta no Yahoo (ou no cache em disco); None quando nenhum dado real foi obtido
+    
+    O booleano indica se veio algum fundamento atual: só com preços o score fica
+    zerado, e só com cache vencido os fundamentos podem ter até 30 dias.
+    """
+    yahoo_tickers = tuple(f"{t}.SA" for t in tickers)
+    
+    # Coleta única para todos os tickers
+    closes = baixar_precos(yahoo_tickers)
+    fundamentos, vencidos = baixar_fundamentos(yahoo_tickers, max_workers)
+    if closes.empty and not fundamentos:
+        return None
+    
+    # Cálculo local, sem rede por ticker
+    # Matriz (dias, tickers) contígua, montada uma única vez; colunas ausentes ficam NaN
+    matriz = closes.reindex(columns=list(yahoo_tickers)).to_numpy(dtype=np.float64)
+    infos = [fundamentos.get(t, {}) for t in yahoo_tickers]
+    resultados, erros = _compute_features(list(tickers), matriz, infos)
+    
+    # Nem a requisição nem o cache vencido trouxeram fundamentos: score e filtros ficam zerados
+    erros += [f"{t}: Fundamentos não disponíveis" for t, yt in zip(tickers, yahoo_tickers) if yt not in fundamentos]
+    erros += [f"{t}: fundamentos do cache vencido" for t, yt in zip(tickers, yahoo_tickers) if yt in vencidos]
+    return resultados, erros, len(fundamentos) > len(vencidos)
+
+def _coletar_fallback(tickers: Tuple[str, ...], motivo: str) -> Tuple[np.ndarray, List[str]]:
+    """Monta o lote só com dados simulados; os demais tickers viram erro"""
     dados_coletados = []
     erros = []
+    for ticker in tickers:
+        dados = _dados_fallback(ticker)
+        if dados:
+            dados_coletados.append(dados)
+        else:
+            erros.append(f"{ticker}: {motivo}")
+    resultados = np.fromiter(
+        (tuple(d[campo] for campo in RESULT_DTYPE.names) for d in dados_coletados),
+        dtype=RESULT_DTYPE, count=len(dados_coletados)
+    )
+    return resultados, erros
+
+@st.cache_data(ttl=900, show_spinner=False)
+def coletar_lote(tickers: Tuple[str, ...], max_workers: int = MAX_WORKERS) -> Tuple[np.ndarray, List[str], bool]:
+    """
+    Coleta e calcula o lote inteiro, cacheado como uma única entrada
     
-    # Testa conexão primeiro
-    with st.spinner("🔍 Testando conexão com Yahoo Finance..."):
-        conexao_ok = test_yfinance_connection()
+    A chave é a tupla ordenada de tickers: a mesma lista, em qualquer ordem,
+    reaproveita o resultado completo. O cache em disco continua por ticker.
+    Retorna também se vieram fundamentos reais do Yahoo (ou do cache).
+    """
+    real = _coletar_real(tickers, max_workers)
+    if real is not None:
+        return real
+    return (*_coletar_fallback(tickers, "Sem resposta do Yahoo Finance"), False)
+
+def processar_tickers(tickers: List[str], max_workers: int = MAX_WORKERS) -> Tuple[np.ndarray, List[str]]:
+    """Processa tickers em lote: um download de preços e uma requisição enxuta de fundamentos por ticker"""
+    tickers_clean = tuple(sorted(t.strip().upper().replace('.SA', '') for t in tickers))
+    resultados, erros, conexao_ok = coletar_lote(tickers_clean, max_workers)
     
+    # O resultado da própria coleta indica o bloqueio, sem sonda prévia
     if not conexao_ok:
         st.warning("⚠️ Conexão direta com Yahoo Finance bloqueada. Usando modo fallback com dados limitados.")
         st.info("💡 Dica: Execute localmente para acesso completo aos dados em tempo real.")
     
-    # Processamento com retry
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(get_stock_data_safe, t): t for t in tickers}
-        
-        for future in as_completed(futures):
-            ticker = futures[future]
-            try:
-                dados, erro = future.result(timeout=12)
-                if dados:
-                    dados_coletados.append(dados)
-                elif erro:
-                    erros.append(erro)
-            except Exception as e:
-                erros.append(f"{ticker}: Timeout ({str(e)[:40]})")
-    
-    return dados_coletados, erros
+    return resultados, erros
+
+TOP_K = 50  # Linhas exibidas na tabela de oportunidades
+
+def top_por_score(df: pd.DataFrame, k: int = TOP_K) -> pd.DataFrame:
+    """
+    As k linhas de maior Score, em ordem decrescente
+    
+    argpartition seleciona em O(N) e só as k escolhidas são ordenadas.
+    """
+    k = min(len(df), k)
+    idx = np.argpartition(-df["Score"].to_numpy(), k - 1)[:k]
+    return df.iloc[idx].sort_values("Score", ascending=False).reset_index(drop=True)
+
+# ===== GRÁFICOS =====
+@st.cache_resource(max_entries=32, show_spinner=False)
+def grafico_dispersao(df: pd.DataFrame) -> go.Figure:
+    """
+    Dispersão ROE x DY, reconstruída só quando o DataFrame filtrado muda
+    
+    cache_resource devolve a mesma figura, sem o pickle/unpickle do cache_data a cada acerto.
+    """
+    return px.scatter(
+        df,
+        x="DY %",
+        y="ROE",
+        size="Score",
+        color="Setor",
+        hover_name="Ação",
+        title="ROE vs Dividend Yield (Tamanho = Score de Qualidade)"
+    )
 
 # ===== INTERFACE PRINCIPAL =====
 st.markdown("# 📈 Rastreador de Ações B3 Pro")
@@ -316,20 +673,22 @@ SAPR11"""
 if analisar and tickers_lista:
     with st.spinner("⏳ Coletando dados (isso pode levar 30-60 segundos no Streamlit Cloud)..."):
         inicio = time.time()
-        dados_coletados, erros = processar_tickers(tickers_lista, max_workers=3)
+        resultados, erros = processar_tickers(tickers_lista)
         tempo_total = time.time() - inicio
     
     # Resultados
-    if dados_coletados:
-        df = pd.DataFrame(dados_coletados)
+    if len(resultados):
+        df = pd.DataFrame(resultados)
+        df["Setor"] = mapear_setores(df["Setor"])
+        df["Ação"] = df["Ação"].astype('category')
         
-        # Aplica filtros
-        df_filtrado = df[
-            (df["DY %"] >= min_dy) &
-            (df["ROE"] >= min_roe) &
-            (df["P/L"] > 0) &
-            (df["P/L"] <= max_pl)
-        ]
+        # Aplica filtros numa única máscara, sem Series intermediárias
+        pl = df["P/L"].to_numpy()
+        mask = df["DY %"].to_numpy() >= min_dy
+        np.logical_and(mask, df["ROE"].to_numpy() >= min_roe, out=mask)
+        np.logical_and(mask, pl > 0, out=mask)
+        np.logical_and(mask, pl <= max_pl, out=mask)
+        df_filtrado = df[mask]
         
         # Métricas
         col1, col2, col3, col4 = st.columns(4)
@@ -346,33 +705,37 @@ if analisar and tickers_lista:
         
         st.success(f"✅ Análise concluída em {tempo_total:.1f} segundos!")
         
+        if erros:
+            with st.expander(f"⚠️ {len(erros)} avisos na coleta"):
+                for erro in erros[:5]:  # Mostra só os 5 primeiros
+                    st.caption(f"• {erro}")
+        
         # Tabela de resultados
         if not df_filtrado.empty:
             st.markdown("## 🏆 Oportunidades Identificadas")
             st.dataframe(
-                df_filtrado.sort_values("Score", ascending=False).reset_index(drop=True),
+                top_por_score(df_filtrado),
                 column_config={
                     "Preço": st.column_config.NumberColumn("Preço", format="R$ %.2f"),
                     "DY %": st.column_config.NumberColumn("DY %", format="%.2f%%"),
                     "ROE": st.column_config.NumberColumn("ROE", format="%.2f%%"),
+                    "P/L": st.column_config.NumberColumn("P/L", format="%.2f"),
+                    "P/VP": st.column_config.NumberColumn("P/VP", format="%.2f"),
+                    "Margem_Liq": st.column_config.NumberColumn("Margem_Liq", format="%.2f"),
+                    "Liquidez_Corr": st.column_config.NumberColumn("Liquidez_Corr", format="%.2f"),
+                    "Divida/PL": st.column_config.NumberColumn("Divida/PL", format="%.2f"),
                     "Score": st.column_config.ProgressColumn("Score", format="%.0f", min_value=0, max_value=100),
                 },
                 use_container_width=True,
                 height=400
             )
+            if len(df_filtrado) > TOP_K:
+                st.caption(f"Exibindo as {TOP_K} melhores de {len(df_filtrado)} ações pelo Score.")
             
             # Gráfico simples
             if len(df_filtrado) >= 2:
                 st.markdown("## 📊 Visualização Rápida")
-                fig = px.scatter(
-                    df_filtrado,
-                    x="DY %",
-                    y="ROE",
-                    size="Score",
-                    color="Setor",
-                    hover_name="Ação",
-                    title="ROE vs Dividend Yield (Tamanho = Score de Qualidade)"
-                )
+                fig = grafico_dispersao(df_filtrado)
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("⚠️ Nenhuma ação atendeu aos critérios. Tente ajustar os filtros.")
@@ -0,0 +1,387 @@
+"""
+Testes da coleta e do cálculo do legacy_rastreador_app
+
+O módulo é um script Streamlit: importá-lo executa a página em modo "bare",
+sem clique no botão, então nenhuma requisição é feita. Os testes de rede
+trocam SESSION.get, CRUMB e yf.Ticker por respostas roteirizadas.
+"""
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+pytest.importorskip("streamlit")
+pytest.importorskip("yfinance")
+pytest.importorskip("plotly")
+
+import legacy_rastreador_app as app
+
+
+def score_escalar(roe, pl, margem_liq, dividend_yield, liquidez_corr, divida_pl):
+    """Escada if/elif original, ticker a ticker, usada como referência"""
+    score = 0.0
+    if roe >= 15: score += 25
+    if 0 < pl <= 15: score += 25
+    if margem_liq >= 10: score += 20
+    if dividend_yield >= 5: score += 15
+    if liquidez_corr >= 1.0: score += 10
+    if divida_pl <= 1.0: score += 5
+    return score
+
+
+def _comparar_com_escalar(colunas):
+    esperado = np.array([score_escalar(*linha) for linha in zip(*colunas)])
+    np.testing.assert_array_equal(app.calcular_score(*colunas), esperado)
+
+
+# ===== SCORE =====
+def test_score_igual_a_escada_escalar_em_linhas_aleatorias():
+    rng = np.random.default_rng(42)
+    n = 3000
+    colunas = [rng.uniform(-5, 40, n) for _ in range(6)]
+    # NaN espalhado: nenhuma regra pontua, como nas comparações escalares
+    for coluna in colunas:
+        coluna[rng.random(n) < 0.1] = np.nan
+    _comparar_com_escalar(colunas)
+
+
+@pytest.mark.parametrize("limite", [0.0, 1.0, 5.0, 10.0, 15.0])
+def test_score_nos_limites_das_regras(limite):
+    # Exatamente no limite e um ulp de cada lado (onde a versão com searchsorted errava)
+    valores = [np.nextafter(limite, -np.inf), limite, np.nextafter(limite, np.inf), np.nan]
+    colunas = [np.array(c) for c in zip(*itertools.product(valores, repeat=6))]
+    _comparar_com_escalar(colunas)
+
+
+# ===== MATRIZ DE FUNDAMENTOS =====
+def test_matriz_fundamentos_converte_valores_invalidos_para_zero():
+    infos = [
+        {
+            "regularMarketPrice": None,
+            "trailingPE": "Infinity",
+            "priceToBook": "-Infinity",
+            "bookValue": "n/a",
+            "returnOnEquity": 0.2,
+            "averageVolume": "12.5",
+        },
+        {},
+    ]
+    matriz = app.matriz_fundamentos(infos)
+
+    assert matriz.shape == (2, len(app.FUND_KEYS))
+    assert matriz.dtype == np.float64
+    assert np.isfinite(matriz).all()
+
+    col = {chave: i for i, chave in enumerate(app.FUND_KEYS)}
+    assert matriz[0, col["regularMarketPrice"]] == 0.0
+    assert matriz[0, col["trailingPE"]] == 0.0
+    assert matriz[0, col["priceToBook"]] == 0.0
+    assert matriz[0, col["bookValue"]] == 0.0
+    assert matriz[0, col["returnOnEquity"]] == pytest.approx(20.0)  # Multiplicador de %
+    assert matriz[0, col["averageVolume"]] == 12.5
+    assert (matriz[1] == 0.0).all()
+
+
+def test_matriz_fundamentos_pode_ser_modificada():
+    matriz = app.matriz_fundamentos([{"trailingPE": 5}])
+    matriz[0, 0] = 1.0  # Não pode ser view somente leitura do DataFrame
+
+
+# ===== ÚLTIMO FECHAMENTO =====
+def test_ultimos_fechamentos_pula_nan_final_e_coluna_vazia():
+    closes = np.array([
+        [10.0, np.nan, 1.0],
+        [11.0, np.nan, np.nan],
+        [np.nan, np.nan, np.nan],
+    ])
+    resultado = app.ultimos_fechamentos(closes)
+    np.testing.assert_array_equal(resultado, [11.0, np.nan, 1.0])
+
+
+def test_ultimos_fechamentos_matriz_sem_dias():
+    resultado = app.ultimos_fechamentos(np.empty((0, 3)))
+    assert resultado.shape == (3,)
+    assert np.isnan(resultado).all()
+
+
+# ===== CACHE EM DISCO =====
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_disk_cache_dentro_do_ttl(cache_dir):
+    app.disk_cache_set("info:PETR4.SA", {"trailingPE": 4.0}, 60)
+    assert app.disk_cache_get("info:PETR4.SA") == {"trailingPE": 4.0}
+
+
+def test_disk_cache_vencido_so_com_tolerancia(cache_dir):
+    app.disk_cache_set("precos:VALE3.SA", [1.0, 2.0], -10)  # Venceu há 10 s
+
+    assert app.disk_cache_get("precos:VALE3.SA") is None
+    assert app.disk_cache_get("precos:VALE3.SA", tolerancia=5) is None
+    assert app.disk_cache_get("precos:VALE3.SA", tolerancia=60) == [1.0, 2.0]
+
+
+def test_disk_cache_ausente_ou_corrompido(cache_dir):
+    assert app.disk_cache_get("info:XXXX3.SA", tolerancia=time.time()) is None
+
+    with open(app._cache_path("info:RUIM3.SA"), "w", encoding="utf-8") as f:
+        f.write("{nao e json")
+    assert app.disk_cache_get("info:RUIM3.SA", tolerancia=time.time()) is None
+
+
+# ===== QUOTESUMMARY E FALLBACKS =====
+RESPOSTA_QUOTE_SUMMARY = {'quoteSummary': {'result': [{
+    'financialData': {
+        'maxAge': 86400,
+        'currentPrice': {'raw': 38.5, 'fmt': '38.50'},
+        'returnOnEquity': {'raw': 0.2, 'fmt': '20%'},
+        'profitMargins': {'raw': 0.15, 'fmt': '15%'},
+    },
+    'summaryDetail': {'maxAge': 1, 'dividendYield': {'raw': 0.12, 'fmt': '12%'}, 'trailingPE': {}},
+    'assetProfile': {
+        'maxAge': 86400,
+        'sector': 'Energy',
+        'longBusinessSummary': 'Petróleo e gás',
+        'companyOfficers': [{'name': 'Fulano'}],
+    },
+}]}}
+# Resposta sem dados financeiros: só o maxAge de cada módulo
+RESPOSTA_VAZIA = {'quoteSummary': {'result': [{'financialData': {'maxAge': 1}, 'summaryDetail': {'maxAge': 1}}]}}
+INFO_YFINANCE = {'currentPrice': 30.0, 'returnOnEquity': 0.25, 'sector': 'Utilities', 'longName': 'Taesa'}
+
+
+class RespostaFalsa:
+    def __init__(self, status_code=200, payload=None, text=''):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+    def json(self):
+        return self.payload
+
+
+class CrumbFalso:
+    """Entrega crumbs em sequência e registra os invalidados"""
+    def __init__(self, *crumbs):
+        self.crumbs = list(crumbs)
+        self.invalidados = []
+
+    def get(self):
+        return self.crumbs[0] if self.crumbs else None
+
+    def invalidar(self, crumb):
+        self.invalidados.append(crumb)
+        self.crumbs.remove(crumb)
+
+
+class TickerFalso:
+    def __init__(self, info):
+        self.chamadas = []
+        self._info = info
+
+    def __call__(self, symbol):
+        self.chamadas.append(symbol)
+        return self
+
+    @property
+    def info(self):
+        if isinstance(self._info, Exception):
+            raise self._info
+        return self._info
+
+
+@pytest.fixture
+def rede(monkeypatch, cache_dir):
+    """Troca SESSION.get por respostas roteirizadas e registra as requisições"""
+    chamadas = []
+    respostas = []
+
+    def get(url, params=None, **kwargs):
+        chamadas.append((url, dict(params or {})))
+        resposta = respostas.pop(0)
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+    monkeypatch.setattr(app.SESSION, "get", get)
+    return chamadas, respostas
+
+
+def test_achatar_quote_summary_extrai_raw_e_renomeia_preco():
+    info = app._achatar_quote_summary(RESPOSTA_QUOTE_SUMMARY['quoteSummary']['result'][0])
+
+    assert info['regularMarketPrice'] == 38.5
+    assert 'currentPrice' not in info
+    assert info['returnOnEquity'] == 0.2
+    assert info['dividendYield'] == 0.12
+    assert info['sector'] == 'Energy'
+    assert 'trailingPE' not in info  # {} sem 'raw' não vira chave
+
+
+def test_achatar_quote_summary_ignora_modulos_que_nao_sao_dict():
+    assert app._achatar_quote_summary({'price': None, 'summaryDetail': {'beta': {'raw': 1.1}}}) == {'beta': 1.1}
+
+
+def test_fundamentos_uteis_rejeita_resposta_so_com_max_age():
+    assert app._fundamentos_uteis({'maxAge': 1}) is None
+    assert app._fundamentos_uteis({'regularMarketPrice': 10.0, 'sector': None}) is None
+    assert app._fundamentos_uteis({}) is None
+    assert app._fundamentos_uteis(None) is None
+
+
+def test_fundamentos_uteis_mantem_so_campos_usados():
+    info = app._achatar_quote_summary(RESPOSTA_QUOTE_SUMMARY['quoteSummary']['result'][0])
+    enxuto = app._fundamentos_uteis(info)
+
+    assert set(enxuto) <= set(app.FUND_KEYS) | {'sector'}
+    assert enxuto['returnOnEquity'] == 0.2
+    assert app._fundamentos_uteis(INFO_YFINANCE)['regularMarketPrice'] == 30.0
+
+
+def test_quote_summary_renova_crumb_apos_401(rede, monkeypatch):
+    chamadas, respostas = rede
+    crumb = CrumbFalso("velho", "novo")
+    monkeypatch.setattr(app, "CRUMB", crumb)
+    respostas += [RespostaFalsa(401), RespostaFalsa(200, RESPOSTA_QUOTE_SUMMARY)]
+
+    info = app._quote_summary("PETR4.SA")
+
+    assert info['returnOnEquity'] == 0.2
+    assert crumb.invalidados == ["velho"]
+    assert [params['crumb'] for _, params in chamadas] == ["velho", "novo"]
+
+
+def test_quote_summary_desiste_apos_dois_401(rede, monkeypatch):
+    chamadas, respostas = rede
+    monkeypatch.setattr(app, "CRUMB", CrumbFalso("a", "b", "c"))
+    respostas += [RespostaFalsa(401), RespostaFalsa(401)]
+
+    assert app._quote_summary("PETR4.SA") is None
+    assert len(chamadas) == 2
+
+
+def test_quote_summary_sem_crumb_nao_faz_requisicao(rede, monkeypatch):
+    chamadas, _ = rede
+    monkeypatch.setattr(app, "CRUMB", CrumbFalso())
+
+    assert app._quote_summary("PETR4.SA") is None
+    assert chamadas == []
+
+
+def test_crumb_espera_antes_de_repetir_handshake_que_falhou():
+    session = requests.Session()
+    tentativas = []
+
+    def get(url, **kwargs):
+        tentativas.append(url)
+        raise requests.ConnectionError("bloqueado")
+
+    session.get = get
+    crumb = app.CrumbYahoo(session)
+
+    assert crumb.get() is None
+    assert crumb.get() is None
+    assert len(tentativas) == 1  # A segunda chamada não repete o handshake
+
+    crumb.falhou_em -= app.CRUMB_ESPERA_FALHA + 1
+    assert crumb.get() is None
+    assert len(tentativas) == 2
+
+
+def test_crumb_rejeita_pagina_html_e_guarda_crumb_valido():
+    session = requests.Session()
+    respostas = [RespostaFalsa(404), RespostaFalsa(200, text="<html>bloqueado</html>"),
+                 RespostaFalsa(404), RespostaFalsa(200, text="abc123\n")]
+    session.get = lambda url, **kwargs: respostas.pop(0)
+    crumb = app.CrumbYahoo(session)
+
+    assert crumb.get() is None
+    crumb.falhou_em -= app.CRUMB_ESPERA_FALHA + 1
+    assert crumb.get() == "abc123"
+    assert crumb.get() == "abc123"  # Reaproveitado, sem novo handshake
+
+    crumb.invalidar("outro")
+    assert crumb.crumb == "abc123"  # Só descarta o crumb que foi recusado
+    crumb.invalidar("abc123")
+    assert crumb.crumb is None
+
+
+def test_buscar_usa_quote_summary_e_cacheia_sem_preco(rede, monkeypatch):
+    _, respostas = rede
+    monkeypatch.setattr(app, "CRUMB", CrumbFalso("c"))
+    ticker = TickerFalso(INFO_YFINANCE)
+    monkeypatch.setattr(app.yf, "Ticker", ticker)
+    respostas.append(RespostaFalsa(200, RESPOSTA_QUOTE_SUMMARY))
+
+    fundamentos, vencidos = app.baixar_fundamentos(("PETR4.SA",), max_workers=1)
+
+    assert fundamentos["PETR4.SA"]['sector'] == 'Energy'
+    assert vencidos == set()
+    assert ticker.chamadas == []
+    cached = app.disk_cache_get("info:PETR4.SA")
+    assert 'regularMarketPrice' not in cached
+    assert set(cached) <= set(app.FUND_KEYS) | {'sector'}
+
+
+def test_buscar_resposta_vazia_cai_para_ticker_info(rede, monkeypatch):
+    _, respostas = rede
+    monkeypatch.setattr(app, "CRUMB", CrumbFalso("c"))
+    ticker = TickerFalso(INFO_YFINANCE)
+    monkeypatch.setattr(app.yf, "Ticker", ticker)
+    respostas.append(RespostaFalsa(200, RESPOSTA_VAZIA))
+
+    fundamentos, vencidos = app.baixar_fundamentos(("TAEE11.SA",), max_workers=1)
+
+    assert ticker.chamadas == ["TAEE11.SA"]
+    assert fundamentos["TAEE11.SA"]['sector'] == 'Utilities'
+    assert app.disk_cache_get("info:TAEE11.SA") == {'returnOnEquity': 0.25, 'sector': 'Utilities'}
+
+
+def test_buscar_sem_quote_summary_nem_ticker_info_usa_cache_vencido(rede, monkeypatch):
+    _, respostas = rede
+    monkeypatch.setattr(app, "CRUMB", CrumbFalso("c"))
+    monkeypatch.setattr(app.yf, "Ticker", TickerFalso(RuntimeError("bloqueado")))
+    respostas += [requests.ConnectionError("bloqueado"), requests.ConnectionError("bloqueado")]
+    app.disk_cache_set("info:VALE3.SA", {'returnOnEquity': 0.3, 'sector': 'Basic Materials'}, -3600)
+
+    fundamentos, vencidos = app.baixar_fundamentos(("VALE3.SA", "ITUB4.SA"), max_workers=1)
+
+    assert fundamentos == {"VALE3.SA": {'returnOnEquity': 0.3, 'sector': 'Basic Materials'}}
+    assert vencidos == {"VALE3.SA"}
+
+
+def test_coletar_real_avisa_fundamentos_ausentes_e_vencidos(monkeypatch):
+    closes = pd.DataFrame({"PETR4.SA": [30.0], "VALE3.SA": [60.0], "ITUB4.SA": [25.0]})
+    monkeypatch.setattr(app, "baixar_precos", lambda yahoo_tickers: closes)
+    monkeypatch.setattr(app, "baixar_fundamentos", lambda yahoo_tickers, max_workers: (
+        {"PETR4.SA": {'sector': 'Energy'}, "VALE3.SA": {'sector': 'Basic Materials'}}, {"VALE3.SA"}
+    ))
+
+    resultados, erros, conexao_ok = app._coletar_real(("ITUB4", "PETR4", "VALE3"), 1)
+
+    assert len(resultados) == 3
+    assert erros == ["ITUB4: Fundamentos não disponíveis", "VALE3: fundamentos do cache vencido"]
+    assert conexao_ok
+
+
+def test_coletar_real_so_com_cache_vencido_sinaliza_bloqueio(monkeypatch):
+    closes = pd.DataFrame({"PETR4.SA": [30.0]})
+    monkeypatch.setattr(app, "baixar_precos", lambda yahoo_tickers: closes)
+    monkeypatch.setattr(app, "baixar_fundamentos", lambda yahoo_tickers, max_workers: (
+        {"PETR4.SA": {'sector': 'Energy'}}, {"PETR4.SA"}
+    ))
+
+    _, erros, conexao_ok = app._coletar_real(("PETR4",), 1)
+
+    assert erros == ["PETR4: fundamentos do cache vencido"]
+    assert not conexao_ok